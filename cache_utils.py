@@ -0,0 +1,38 @@
+import functools
+import time
+from collections import OrderedDict
+
+
+def async_ttl_cache(maxsize: int = 128, ttl: float = 120):
+    """
+    Cache the results of an async function for 'ttl' seconds,
+    keyed on its call arguments, keeping at most 'maxsize' entries.
+    Error payloads ({"error": ...}) are not cached.
+    """
+    def decorator(func):
+        cache: OrderedDict = OrderedDict()
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            now = time.monotonic()
+
+            entry = cache.get(key)
+            if entry is not None and now - entry[0] < ttl:
+                cache.move_to_end(key)
+                return entry[1]
+
+            result = await func(*args, **kwargs)
+
+            if not (isinstance(result, dict) and "error" in result):
+                cache[key] = (now, result)
+                cache.move_to_end(key)
+                if len(cache) > maxsize:
+                    cache.popitem(last=False)
+
+            return result
+
+        wrapper.cache_clear = cache.clear
+        return wrapper
+
+    return decorator
@@ -1,28 +1,59 @@
+import atexit
+import contextlib
 import logging
+import queue
 import sys
 import time
+from logging.handlers import QueueHandler, QueueListener
 from fastapi import FastAPI, Query # type: ignore
 from fastapi.middleware.cors import CORSMiddleware # type: ignore
+from fastapi.middleware.gzip import GZipMiddleware # type: ignore
+from fastapi.responses import ORJSONResponse # type: ignore
 from typing import Literal
 
-from supabase_utils import initialize_supabase, get_table_info, check_table_exists, get_avg_delay_by_station, get_unique_stations_count_from_db
+from supabase_utils import initialize_supabase, close_supabase, get_table_info, check_table_exists, get_avg_delay_by_station, get_unique_stations_count_from_db, clear_caches
 
 
+# Handlers run on a background thread so log writes never block the event loop
+log_formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+log_handlers = [
+    logging.StreamHandler(sys.stdout),
+    logging.FileHandler("tgv_tracker.log")
+]
+for handler in log_handlers:
+    handler.setFormatter(log_formatter)
+
+log_queue = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, *log_handlers, respect_handler_level=True)
+
+# QueueHandler.prepare formats the record before queueing it, so the root
+# format must be the bare message; the listener's handlers add the prefix
 logging.basicConfig(
     level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler("tgv_tracker.log")
-    ]
+    format="%(message)s",
+    handlers=[QueueHandler(log_queue)]
 )
+# Started and stopped once per process, independently of app lifespans
+log_listener.start()
+atexit.register(log_listener.stop)
 
 logger = logging.getLogger("tgv_tracker")
 
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.info("TGV Tracker API starting up...")
+    await initialize_supabase()
+    await check_table_exists()
+    yield
+    logger.info("TGV Tracker API shutting down...")
+    await close_supabase()
+
 app = FastAPI(
     title="TGV Tracker API",
     description="A minimal API for TGV tracking",
-    version="0.1.0"
+    version="0.1.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -38,15 +69,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.on_event("startup")
-async def startup_event():
-    logger.info("TGV Tracker API starting up...")
-    await initialize_supabase()
-    await check_table_exists()
-
-@app.on_event("shutdown")
-async def shutdown_event():
-    logger.info("TGV Tracker API shutting down...")
+# Compress JSON responses large enough to benefit from it
+app.add_middleware(GZipMiddleware, minimum_size=512)
 
 @app.get("/")
 async def root():
@@ -59,19 +83,28 @@ async def health_check():
     return {"status": "healthy"}
 
 @app.get("/api/count_rows")
-async def get_count_rows():
-    logger.info("Count rows endpoint accessed")
-    table_info = await get_table_info()
+async def get_count_rows(
+    exact: bool = Query(default=False, description="Use an exact count instead of the planner estimate")
+):
+    logger.info(f"Count rows endpoint accessed - exact: {exact}")
+    table_info = await get_table_info(exact=exact)
     return {"row_count": table_info}
 
+@app.post("/api/cache/invalidate")
+async def invalidate_cache():
+    """Clear cached query results once new data has been loaded"""
+    logger.info("Cache invalidate endpoint accessed")
+    clear_caches()
+    return {"status": "cache cleared"}
+
 @app.get("/api/delays")
 async def get_delays(
     table_name: str = Query(default="tgv-data", description="Table name to query"),
     limit: int = Query(default=10, ge=1, le=100, description="Number of results to return"),
     order: Literal["asc", "desc"] = Query(default="asc", description="Sort order: 'asc' for best (lowest delays), 'desc' for worst (highest delays)")
 ):
-    """Get average delays by station using pandas technique"""
-    logger.info(f"Delays pandas endpoint accessed - table: {table_name}, limit: {limit}, order: {order}")
+    """Get average delays by station, aggregated in Postgres"""
+    logger.info(f"Delays endpoint accessed - table: {table_name}, limit: {limit}, order: {order}")
     
     start_time = time.time()
     result = await get_avg_delay_by_station(table_name, limit, order)
@@ -79,12 +112,12 @@ async def get_delays(
     
     execution_time = round((end_time - start_time) * 1000, 2)  # Convert to milliseconds
     
-    logger.info(f"Pandas query executed in {execution_time}ms")
+    logger.info(f"Delays query executed in {execution_time}ms")
     
     order_description = "best (lowest delays)" if order == "asc" else "worst (highest delays)"
     
     return {
-        "method": "pandas",
+        "method": result.get("method"),
         "execution_time_ms": execution_time,
         "table_name": table_name,
         "limit": limit,
@@ -0,0 +1,10 @@
+-- Store retard_moyen_depart as a number so PostgREST returns JSON numbers and
+-- the aggregates in the following migrations need no cast. Values are coerced
+-- like pd.to_numeric(errors='coerce'): comma decimals are accepted and
+-- anything that is not a number (empty, 'N/A', ...) becomes null.
+alter table "tgv-data"
+  alter column retard_moyen_depart type double precision
+  using case
+    when replace(trim(retard_moyen_depart::text), ',', '.') ~ '^[-+]?([0-9]+\.?[0-9]*|\.[0-9]+)([eE][-+]?[0-9]+)?$'
+      then replace(trim(retard_moyen_depart::text), ',', '.')::double precision
+  end;
@@ -0,0 +1,24 @@
+-- Average departure delay per station for National service, aggregated in
+-- Postgres so the API only receives the top `lim` rows.
+create or replace function public.avg_delay_by_station(
+  tbl text default 'tgv-data',
+  lim int default 10,
+  ord text default 'asc'
+)
+returns table (gare_depart text, retard_moyen_depart numeric)
+language plpgsql
+stable
+as $$
+begin
+  return query execute format(
+    'select gare_depart::text, avg(retard_moyen_depart::numeric)
+       from %I
+      where service = ''National''
+      group by gare_depart
+      order by 2 %s nulls last
+      limit $1',
+    tbl,
+    case when lower(ord) = 'asc' then 'asc' else 'desc' end
+  ) using lim;
+end;
+$$;
@@ -0,0 +1,19 @@
+-- Number of distinct departure stations for National service, counted in
+-- Postgres so the API receives a single integer.
+create or replace function public.unique_stations_count(
+  tbl text default 'tgv-data'
+)
+returns bigint
+language plpgsql
+stable
+as $$
+declare
+  n bigint;
+begin
+  execute format(
+    'select count(distinct gare_depart) from %I where service = ''National''',
+    tbl
+  ) into n;
+  return n;
+end;
+$$;
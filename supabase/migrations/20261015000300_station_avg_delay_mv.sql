@@ -0,0 +1,30 @@
+-- Precomputed average departure delay per station for National service.
+-- Refresh after each ingestion with: select public.refresh_station_avg_delay_mv();
+create materialized view if not exists public.station_avg_delay_mv as
+select
+  gare_depart,
+  avg(retard_moyen_depart) as avg_delay,
+  count(*) as n
+from "tgv-data"
+where service = 'National'
+group by 1;
+
+-- Required by refresh ... concurrently
+create unique index if not exists station_avg_delay_mv_gare_depart_idx
+  on public.station_avg_delay_mv (gare_depart);
+
+create index if not exists station_avg_delay_mv_avg_delay_idx
+  on public.station_avg_delay_mv (avg_delay);
+
+grant select on public.station_avg_delay_mv to anon, authenticated;
+
+create or replace function public.refresh_station_avg_delay_mv()
+returns void
+language sql
+security definer
+set search_path = public
+as $$
+  refresh materialized view concurrently public.station_avg_delay_mv;
+$$;
+
+revoke execute on function public.refresh_station_avg_delay_mv() from public, anon, authenticated;
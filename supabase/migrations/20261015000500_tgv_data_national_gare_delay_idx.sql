@@ -0,0 +1,10 @@
+-- Covering partial index for the National-service aggregates: the
+-- avg_delay_by_station / unique_stations_count functions and the
+-- station_avg_delay_mv refresh can read it with an Index Only Scan in
+-- gare_depart order, feeding a GroupAggregate instead of seq scan + hash.
+create index if not exists tgv_data_nat_gare_delay_idx
+  on "tgv-data" (gare_depart)
+  include (retard_moyen_depart)
+  where service = 'National';
+
+analyze "tgv-data";
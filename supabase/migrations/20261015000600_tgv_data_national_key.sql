@@ -0,0 +1,5 @@
+-- One row per month and route for National service. Enforces the key the API
+-- orders by when paging through rows, and lets that ordered scan use an index.
+create unique index if not exists tgv_data_national_key_idx
+  on "tgv-data" (date, gare_depart, gare_arrivee)
+  where service = 'National';
@@ -0,0 +1,11 @@
+-- Refresh the precomputed average delays every hour with pg_cron, so new
+-- rows reach /api/delays without the API holding privileged credentials.
+-- Ingestion jobs can also call public.refresh_station_avg_delay_mv() directly
+-- right after loading data.
+create extension if not exists pg_cron;
+
+select cron.schedule(
+  'refresh-station-avg-delay-mv',
+  '0 * * * *',
+  'select public.refresh_station_avg_delay_mv()'
+);
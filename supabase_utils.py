@@ -1,117 +1,257 @@
 import logging
-import pandas as pd # type: ignore
 import os
-import sys
 from dotenv import load_dotenv # type: ignore
-from fastapi import FastAPI # type: ignore
 from pathlib import Path
-from supabase import create_client, Client # type: ignore
+import httpx # type: ignore
+import numpy as np # type: ignore
 from typing import Optional
 import json
 from datetime import date, datetime
 
+from cache_utils import async_ttl_cache
 
-load_dotenv()
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler("tgv_tracker.log")
-    ]
-)
+load_dotenv()
 
 logger = logging.getLogger("tgv_tracker")
 
-app = FastAPI(
-    title="TGV Tracker API",
-    description="A minimal API for TGV tracking",
-    version="0.1.0"
-)
-
 # Supabase configuration
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Optional[Client] = None
+http_client: Optional[httpx.AsyncClient] = None
+
+# Rows fetched per request when scanning a table client-side
+PAGE_SIZE = 10_000
+
+# Offset paging needs a total order on a unique key; tables without a known
+# key are paged unordered
+PAGE_ORDERS = {"tgv-data": "date.asc,gare_depart.asc,gare_arrivee.asc"}
+
+# Materialized views holding precomputed average delays per station
+AVG_DELAY_VIEWS = {"tgv-data": "station_avg_delay_mv"}
+
+# PostgREST / Postgres error codes for a function or relation that does not exist
+MISSING_OBJECT_CODES = {"PGRST202", "PGRST205", "42P01", "42883"}
 
 async def initialize_supabase():
-    """Initialize Supabase client"""
-    global supabase
+    """Initialize the pooled HTTP client for the Supabase REST API"""
+    global http_client
     if SUPABASE_URL and SUPABASE_KEY:
-        supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+        http_client = httpx.AsyncClient(
+            base_url=f"{SUPABASE_URL}/rest/v1",
+            headers={"apikey": SUPABASE_KEY, "Authorization": f"Bearer {SUPABASE_KEY}"},
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20),
+        )
         logger.info("Supabase client initialized")
     else:
         logger.error("Supabase credentials not found in environment variables")
 
+async def close_supabase():
+    """Close the HTTP client and its pooled connections"""
+    global http_client
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+        logger.info("Supabase client closed")
+
+def _parse_content_range_total(content_range: Optional[str]) -> Optional[int]:
+    """Total from a Content-Range header like "0-24/3573" or "*/3573", None if not counted ("*/*")"""
+    if not content_range:
+        return None
+    total = content_range.rsplit("/", 1)[-1]
+    return int(total) if total.isdigit() else None
+
+async def _count_rows(table_name: str, count: str) -> Optional[int]:
+    """Row count of a table from the Content-Range header of a HEAD request, None if unknown"""
+    response = await http_client.head(f"/{table_name}", headers={"Prefer": f"count={count}"})
+    response.raise_for_status()
+    return _parse_content_range_total(response.headers.get("content-range"))
+
+def _is_missing_object(error: Exception) -> bool:
+    """Whether a failed request means the function or view is not deployed"""
+    if not isinstance(error, httpx.HTTPStatusError):
+        return False
+    if error.response.status_code == 404:
+        return True
+    try:
+        return error.response.json().get("code") in MISSING_OBJECT_CODES
+    except ValueError:
+        return False
+
+async def _rpc(function_name: str, params: dict):
+    """Call a Postgres function exposed by PostgREST"""
+    response = await http_client.post(f"/rpc/{function_name}", json=params)
+    response.raise_for_status()
+    return response.json()
+
 async def check_table_exists(table_name: str = "tgv-data"):
     """Check if a table exists in Supabase"""
-    if supabase is None:
+    if http_client is None:
         logger.error("Supabase client not initialized")
         return {"exists": False, "error": "Supabase client not initialized"}
     
     try:
-        # Check if table exists and get row count
-        result = supabase.table(table_name).select("*", count="exact").limit(0).execute()
-        row_count = result.count if hasattr(result, 'count') else 0
+        # Check if table exists; the planner estimate avoids a full count on
+        # every boot, and the request also opens the pooled connection
+        row_count = await _count_rows(table_name, "estimated")
 
-        logger.info(f"Table '{table_name}' exists with {row_count} rows")
+        if row_count is None:
+            logger.info(f"Table '{table_name}' exists, row count unavailable")
+        else:
+            logger.info(f"Table '{table_name}' exists with about {row_count} rows")
 
     except Exception as e:
         logger.info(f"Table '{table_name}' does not exist : {str(e)}")
 
-async def get_table_info(table_name: str = "tgv-data"):
-    if supabase is None:
+@async_ttl_cache(maxsize=128, ttl=30)
+async def get_table_info(table_name: str = "tgv-data", exact: bool = False):
+    """
+    Get the row count of a table with a HEAD request, using the planner
+    estimate unless an exact count is requested
+    """
+    if http_client is None:
         logger.error("Supabase client not initialized")
         return {"exists": False, "error": "Supabase client not initialized"}
     
-    # Check if table exists and get row count
-    result = supabase.table(table_name).select("*", count="exact").limit(0).execute()
-    return result.count if hasattr(result, 'count') else 0
+    row_count = await _count_rows(table_name, "exact" if exact else "estimated")
+    if row_count is None:
+        # Returned as an error so the missing count is not cached
+        logger.warning(f"No row count returned for table '{table_name}'")
+        return {"error": "Row count unavailable"}
+    return row_count
+
+async def _iter_national_pages(table_name: str, columns: str):
+    """Yield National service rows page by page instead of in one response"""
+    offset = 0
+    while True:
+        params = {
+            "select": columns,
+            "service": "eq.National",
+            "offset": offset,
+            "limit": PAGE_SIZE,
+        }
+        if table_name in PAGE_ORDERS:
+            params["order"] = PAGE_ORDERS[table_name]
+        response = await http_client.get(f"/{table_name}", params=params)
+        response.raise_for_status()
+        rows = response.json()
+        if not rows:
+            break
+        yield rows
+        # The server may cap the page below PAGE_SIZE, so advance by what was returned
+        offset += len(rows)
+
+async def _avg_delay_by_station_client_side(table_name: str, limit: int, order: str):
+    """Fallback for get_avg_delay_by_station when the database aggregation is unavailable"""
+    label_of: dict[str, int] = {}
+    sums = np.zeros(0, dtype=np.float64)
+    counts = np.zeros(0, dtype=np.int64)
+    async for page in _iter_national_pages(table_name, "gare_depart,retard_moyen_depart"):
+        # Factorize station names into integer labels. Delays arrive as JSON
+        # numbers once the column is double precision; the fallback also runs
+        # before the migrations are applied, so text values are coerced and
+        # non-numeric ones skipped
+        labels: list[int] = []
+        delays: list[float] = []
+        for row in page:
+            delay = row['retard_moyen_depart']
+            if delay is None:
+                continue
+            if not isinstance(delay, (int, float)):
+                try:
+                    delay = float(str(delay).strip().replace(",", "."))
+                except ValueError:
+                    continue
+            labels.append(label_of.setdefault(row['gare_depart'], len(label_of)))
+            delays.append(delay)
+        
+        # np.bincount returns int64 for empty input, so skip pages without delays
+        if not labels:
+            continue
+        
+        # Grouped sum and count of the page, merged into the running totals
+        page_labels = np.array(labels, dtype=np.int32)
+        page_sums = np.bincount(page_labels, weights=np.asarray(delays, dtype=np.float64),
+                                minlength=len(label_of))
+        page_counts = np.bincount(page_labels, minlength=len(label_of))
+        page_sums[:len(sums)] += sums
+        page_counts[:len(counts)] += counts
+        sums, counts = page_sums, page_counts
+    
+    if not label_of:
+        return []
+    
+    means = sums / counts
+    keys = means if order.lower() == "asc" else -means
+    
+    # Partial selection of the top 'limit' stations, then sort only those
+    top = np.arange(len(keys))
+    if limit < len(keys):
+        top = np.argpartition(keys, limit - 1)[:limit]
+    top = top[np.argsort(keys[top], kind="stable")]
+    
+    stations = list(label_of)
+    return [{"gare_depart": stations[i], "retard_moyen_depart": float(means[i])} for i in top]
 
+async def _avg_delay_by_station_from_db(table_name: str, limit: int, order: str):
+    """
+    Read the top stations from the materialized view, or aggregate via RPC
+    if the table has none. Returns the rows and the method used
+    """
+    view_name = AVG_DELAY_VIEWS.get(table_name)
+    if view_name is None:
+        rows = await _rpc(
+            "avg_delay_by_station",
+            {"tbl": table_name, "lim": limit, "ord": order.lower()}
+        )
+        return rows, "rpc"
+    
+    direction = "asc" if order.lower() == "asc" else "desc"
+    response = await http_client.get(f"/{view_name}", params={
+        "select": "gare_depart,retard_moyen_depart:avg_delay",
+        "order": f"avg_delay.{direction}.nullslast",
+        "limit": limit,
+    })
+    response.raise_for_status()
+    return response.json(), "materialized_view"
+
+@async_ttl_cache(maxsize=128, ttl=120)
 async def get_avg_delay_by_station(table_name: str = "tgv-data", limit: int = 10, order: str = "asc"):
     """
     Group by 'gare_depart' and calculate average 'retard_moyen_depart',
     ordered by order parameter (asc/desc), returning first 'limit' rows
     Only for National service
     """
-    if supabase is None:
+    if http_client is None:
         logger.error("Supabase client not initialized")
         return {"error": "Supabase client not initialized"}
     
     try:
-        # Fetch all data first (for simple implementation) - filter by service = "National"
-        result = supabase.table(table_name).select("gare_depart, retard_moyen_depart, service").eq("service", "National").execute()
+        try:
+            # Aggregate in Postgres and only fetch the top rows
+            result_data, method = await _avg_delay_by_station_from_db(table_name, limit, order)
+        except Exception as e:
+            # Only a missing function or view justifies scanning the whole table;
+            # timeouts and server errors are reported as they are
+            if not _is_missing_object(e):
+                raise
+            logger.warning(f"Database aggregation unavailable, aggregating client-side: {str(e)}")
+            result_data = await _avg_delay_by_station_client_side(table_name, limit, order)
+            method = "client_side"
         
-        if not result.data:
+        if not result_data:
             logger.warning(f"No National service data found in table '{table_name}'")
-            return {"data": [], "message": "No National service data found"}
-        
-        # Convert to pandas DataFrame for aggregation
-        df = pd.DataFrame(result.data)
-        
-        # Clean and convert retard_moyen_depart to numeric
-        df['retard_moyen_depart'] = pd.to_numeric(df['retard_moyen_depart'], errors='coerce')
+            return {"data": [], "method": method, "message": "No National service data found"}
         
-        # Determine sort order
         ascending = order.lower() == "asc"
         
-        # Group by gare_depart and calculate mean, then sort and limit
-        avg_delays = (df.groupby('gare_depart')['retard_moyen_depart']
-                    .mean()
-                    .reset_index()
-                    .sort_values('retard_moyen_depart', ascending=ascending)
-                    .head(limit))
-        
-        # Convert back to list of dictionaries
-        result_data = avg_delays.to_dict('records')
-        
         order_desc = "lowest" if ascending else "highest"
         logger.info(f"Retrieved top {len(result_data)} National service stations with {order_desc} average delays")
         
         return {
             "data": result_data,
+            "method": method,
             "count": len(result_data),
             "table_name": table_name,
             "order": order,
@@ -125,15 +265,25 @@ async def get_avg_delay_by_station(table_name: str = "tgv-data", limit: int = 10
 
 async def get_unique_stations_count_from_db(table_name: str = "tgv-data"):
     """Get the total number of unique gare_depart stations for National service"""
-    if supabase is None:
+    if http_client is None:
         logger.error("Supabase client not initialized")
         return {"error": "Supabase client not initialized"}
     
     try:
-        # Fetch all gare_depart data for National service
-        result = supabase.table(table_name).select("gare_depart").execute()
+        try:
+            # Count distinct stations in Postgres
+            unique_count = await _rpc("unique_stations_count", {"tbl": table_name})
+        except Exception as e:
+            if not _is_missing_object(e):
+                raise
+            logger.warning(f"RPC unique_stations_count unavailable, counting client-side: {str(e)}")
+            stations = set()
+            async for page in _iter_national_pages(table_name, "gare_depart"):
+                stations.update(row['gare_depart'] for row in page)
+            stations.discard(None)
+            unique_count = len(stations)
         
-        if not result.data:
+        if not unique_count:
             logger.warning(f"No National service data found in table '{table_name}'")
             return {
                 "unique_stations_count": 0,
@@ -141,15 +291,10 @@ async def get_unique_stations_count_from_db(table_name: str = "tgv-data"):
                 "service_filter": "National"
             }
         
-        # Convert to pandas DataFrame and get unique count
-        df = pd.DataFrame(result.data)
-        unique_count = df['gare_depart'].nunique()
-        
         logger.info(f"Found {unique_count} unique stations for National service in table '{table_name}'")
         
         return {
             "unique_stations_count": unique_count,
-            "total_records": len(result.data),
             "table_name": table_name,
             "service_filter": "National"
         }
@@ -157,3 +302,9 @@ async def get_unique_stations_count_from_db(table_name: str = "tgv-data"):
     except Exception as e:
         logger.error(f"Error getting unique stations count: {str(e)}")
         return {"error": str(e)}
+
+def clear_caches():
+    """Drop cached query results, e.g. after new rows have been ingested"""
+    get_table_info.cache_clear()
+    get_avg_delay_by_station.cache_clear()
+    logger.info("Query caches cleared")
@@ -0,0 +1,74 @@
+import asyncio
+
+import pytest
+
+import cache_utils
+from cache_utils import async_ttl_cache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache_utils.time, "monotonic", lambda: now[0])
+    return now
+
+
+def counting(result=lambda *args: list(args), **cache_kwargs):
+    calls = []
+
+    @async_ttl_cache(**cache_kwargs)
+    async def func(*args):
+        calls.append(args)
+        return result(*args)
+
+    return func, calls
+
+
+def test_hit_within_ttl(clock):
+    func, calls = counting(ttl=10)
+
+    first = asyncio.run(func("a"))
+    clock[0] += 9
+    second = asyncio.run(func("a"))
+
+    assert first is second
+    assert calls == [("a",)]
+
+
+def test_miss_after_ttl(clock):
+    func, calls = counting(ttl=10)
+
+    asyncio.run(func("a"))
+    clock[0] += 10
+    asyncio.run(func("a"))
+
+    assert calls == [("a",), ("a",)]
+
+
+def test_evicts_least_recently_used_at_maxsize(clock):
+    func, calls = counting(maxsize=2, ttl=10)
+
+    for key in ["a", "b", "a", "c", "a", "b"]:
+        asyncio.run(func(key))
+
+    # "b" was evicted when "c" arrived, "a" stayed because it was used again
+    assert calls == [("a",), ("b",), ("c",), ("b",)]
+
+
+def test_error_payloads_are_not_cached(clock):
+    func, calls = counting(result=lambda *args: {"error": "boom"}, ttl=10)
+
+    asyncio.run(func("a"))
+    asyncio.run(func("a"))
+
+    assert calls == [("a",), ("a",)]
+
+
+def test_cache_clear(clock):
+    func, calls = counting(ttl=10)
+
+    asyncio.run(func("a"))
+    func.cache_clear()
+    asyncio.run(func("a"))
+
+    assert calls == [("a",), ("a",)]
@@ -0,0 +1,177 @@
+import asyncio
+
+import httpx
+import pytest
+
+import supabase_utils
+
+
+def serve_pages(rows, max_rows=1000):
+    """Mock PostgREST table endpoint honouring offset/limit and a server-side row cap"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        offset = int(request.url.params.get("offset", 0))
+        limit = min(int(request.url.params.get("limit", max_rows)), max_rows)
+        columns = request.url.params["select"].split(",")
+        page = [{column: row[column] for column in columns} for row in rows[offset:offset + limit]]
+        return httpx.Response(200, json=page)
+    return handler
+
+
+@pytest.fixture
+def use_transport(monkeypatch):
+    def install(handler):
+        client = httpx.AsyncClient(base_url="http://test/rest/v1", transport=httpx.MockTransport(handler))
+        monkeypatch.setattr(supabase_utils, "http_client", client)
+    return install
+
+
+def test_client_side_average_handles_all_null_page(use_transport):
+    rows = (
+        [{"gare_depart": f"S{i % 5}", "retard_moyen_depart": float(i % 5)} for i in range(1000)]
+        + [{"gare_depart": f"S{i % 7}", "retard_moyen_depart": None} for i in range(1000)]
+        + [{"gare_depart": "S9", "retard_moyen_depart": 20.0} for _ in range(10)]
+    )
+    use_transport(serve_pages(rows))
+
+    result = asyncio.run(supabase_utils._avg_delay_by_station_client_side("tgv-data", 3, "desc"))
+
+    assert result == [
+        {"gare_depart": "S9", "retard_moyen_depart": 20.0},
+        {"gare_depart": "S4", "retard_moyen_depart": 4.0},
+        {"gare_depart": "S3", "retard_moyen_depart": 3.0},
+    ]
+
+
+def test_client_side_average_matches_per_station_mean(use_transport):
+    rows = [
+        {"gare_depart": "A", "retard_moyen_depart": 1.0},
+        {"gare_depart": "B", "retard_moyen_depart": 5.0},
+        {"gare_depart": "A", "retard_moyen_depart": 3.0},
+        {"gare_depart": "C", "retard_moyen_depart": None},
+        {"gare_depart": "B", "retard_moyen_depart": 7.0},
+    ]
+    use_transport(serve_pages(rows, max_rows=2))
+
+    result = asyncio.run(supabase_utils._avg_delay_by_station_client_side("tgv-data", 10, "asc"))
+
+    assert result == [
+        {"gare_depart": "A", "retard_moyen_depart": 2.0},
+        {"gare_depart": "B", "retard_moyen_depart": 6.0},
+    ]
+
+
+def test_client_side_average_coerces_unmigrated_text_delays(use_transport):
+    rows = [
+        {"gare_depart": "A", "retard_moyen_depart": "2.5"},
+        {"gare_depart": "A", "retard_moyen_depart": "3,5"},
+        {"gare_depart": "A", "retard_moyen_depart": "N/A"},
+        {"gare_depart": "B", "retard_moyen_depart": ""},
+    ]
+    use_transport(serve_pages(rows))
+
+    result = asyncio.run(supabase_utils._avg_delay_by_station_client_side("tgv-data", 10, "asc"))
+
+    assert result == [{"gare_depart": "A", "retard_moyen_depart": 3.0}]
+
+
+def test_client_side_average_without_rows(use_transport):
+    use_transport(serve_pages([]))
+
+    assert asyncio.run(supabase_utils._avg_delay_by_station_client_side("tgv-data", 10, "asc")) == []
+
+
+def test_average_delay_falls_back_when_view_is_missing(use_transport):
+    rows = [{"gare_depart": "A", "retard_moyen_depart": 4.0}]
+    table = serve_pages(rows)
+
+    def handler(request):
+        if "station_avg_delay_mv" in request.url.path:
+            return httpx.Response(404, json={"code": "PGRST205", "message": "missing"})
+        return table(request)
+    use_transport(handler)
+    supabase_utils.get_avg_delay_by_station.cache_clear()
+
+    result = asyncio.run(supabase_utils.get_avg_delay_by_station("tgv-data", 10, "asc"))
+
+    assert result["data"] == [{"gare_depart": "A", "retard_moyen_depart": 4.0}]
+    assert result["method"] == "client_side"
+
+
+def test_average_delay_does_not_fall_back_on_server_error(use_transport):
+    requested = []
+
+    def handler(request):
+        requested.append(request.url.path)
+        return httpx.Response(503, json={"message": "unavailable"})
+    use_transport(handler)
+    supabase_utils.get_avg_delay_by_station.cache_clear()
+
+    result = asyncio.run(supabase_utils.get_avg_delay_by_station("tgv-data", 10, "asc"))
+
+    assert "error" in result
+    assert requested == ["/rest/v1/station_avg_delay_mv"]
+
+
+def test_unique_stations_count_falls_back_only_when_function_is_missing(use_transport):
+    rows = [{"gare_depart": name} for name in ["A", "B", "A", None]]
+    table = serve_pages(rows)
+
+    def handler(request):
+        if request.url.path.endswith("/rpc/unique_stations_count"):
+            return httpx.Response(404, json={"code": "PGRST202", "message": "missing"})
+        return table(request)
+    use_transport(handler)
+
+    result = asyncio.run(supabase_utils.get_unique_stations_count_from_db("tgv-data"))
+
+    assert result["unique_stations_count"] == 2
+
+    use_transport(lambda request: httpx.Response(500, json={"message": "boom"}))
+
+    assert "error" in asyncio.run(supabase_utils.get_unique_stations_count_from_db("tgv-data"))
+
+
+def collect_orders(use_transport, table_name):
+    orders = []
+    table = serve_pages([{"gare_depart": "A"}] * 3, max_rows=2)
+
+    def handler(request):
+        orders.append(request.url.params.get("order"))
+        return table(request)
+    use_transport(handler)
+
+    async def collect():
+        return [row async for page in supabase_utils._iter_national_pages(table_name, "gare_depart") for row in page]
+
+    assert len(asyncio.run(collect())) == 3
+    return orders
+
+
+def test_pages_are_requested_in_a_stable_order(use_transport):
+    assert collect_orders(use_transport, "tgv-data") == [supabase_utils.PAGE_ORDERS["tgv-data"]] * 3
+
+
+def test_pages_of_tables_without_known_key_are_not_ordered(use_transport):
+    assert collect_orders(use_transport, "other-table") == [None] * 3
+
+
+
+@pytest.mark.parametrize("content_range, expected", [
+    ("0-24/3573", 3573),
+    ("*/3573", 3573),
+    ("*/*", None),
+    (None, None),
+])
+def test_parse_content_range_total(content_range, expected):
+    assert supabase_utils._parse_content_range_total(content_range) == expected
+
+
+def test_table_info_does_not_report_missing_count_as_empty(use_transport):
+    use_transport(lambda request: httpx.Response(200, headers={"content-range": "*/*"}))
+    supabase_utils.get_table_info.cache_clear()
+
+    assert "error" in asyncio.run(supabase_utils.get_table_info("tgv-data"))
+
+    use_transport(lambda request: httpx.Response(200, headers={"content-range": "*/3573"}))
+
+    assert asyncio.run(supabase_utils.get_table_info("tgv-data")) == 3573